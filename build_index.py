@@ -0,0 +1,128 @@
+# build_index.py
+"""
+Convert the flat FAISS index published on Hugging Face into an approximate
+index (HNSW or IVF-PQ) for sub-linear top-k search, or into a cosine
+(normalized inner-product) index with --metric ip.
+
+Flat search is memory-bandwidth bound, not compute bound: every query streams
+all stored vectors through the CPU. Storing fewer bytes per vector (--kind sq8,
+or fewer --dimensions) speeds it up far more than faster arithmetic would.
+
+Example:
+    python build_index.py --kind hnsw --output drug_embeddings_hnsw.faiss
+    python build_index.py --kind flat --metric ip --output drug_embeddings_ip.faiss
+    python build_index.py --kind sq8 --dimensions 1024 --output drug_embeddings_sq8_1024.faiss
+"""
+import argparse
+import logging
+import numpy as np
+import faiss
+from huggingface_hub import hf_hub_download
+
+LOGGER = logging.getLogger("build_index")
+
+HF_REPO = "PotatoUmair/drug-rag-data1"  # keep in sync with rag_pipeline.HF_REPO
+
+
+def load_source_index(path: str = None) -> faiss.Index:
+    if path is None:
+        path = hf_hub_download(
+            repo_id=HF_REPO,
+            filename="drug_embeddings.faiss",
+            repo_type="dataset"
+        )
+    LOGGER.info("Loading source index from %s", path)
+    return faiss.read_index(path)
+
+
+def build_flat(vectors, metric: int) -> faiss.Index:
+    index = faiss.IndexFlat(vectors.shape[1], metric)
+    index.add(vectors)
+    return index
+
+
+def build_sq8(vectors, metric: int) -> faiss.Index:
+    # 1 byte per dimension instead of 4.
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], faiss.ScalarQuantizer.QT_8bit, metric)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def shorten(vectors, dimensions: int):
+    """
+    Keep the first `dimensions` components and re-normalize. For text-embedding-3
+    models this matches what the API returns for `dimensions=N`.
+    """
+    vectors = np.ascontiguousarray(vectors[:, :dimensions])
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def build_hnsw(vectors, metric: int, m: int = 32, ef_construction: int = 200) -> faiss.Index:
+    index = faiss.IndexHNSWFlat(vectors.shape[1], m, metric)
+    index.hnsw.efConstruction = ef_construction
+    index.add(vectors)
+    return index
+
+
+def build_ivfpq(vectors, metric: int, nlist: int = 4096, pq_m: int = 64, nbits: int = 8) -> faiss.Index:
+    d = vectors.shape[1]
+    # IVF training needs ~39 points per list; shrink nlist for small corpora.
+    nlist = max(1, min(nlist, vectors.shape[0] // 39))
+    quantizer = faiss.IndexFlat(d, metric)
+    index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m, nbits, metric)
+    index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Local flat index; downloaded from Hugging Face if omitted.")
+    parser.add_argument("--output", required=True, help="Where to write the converted index.")
+    parser.add_argument("--kind", choices=["flat", "sq8", "hnsw", "ivfpq"], default="hnsw")
+    parser.add_argument("--metric", choices=["l2", "ip"], help="Defaults to the source index metric.")
+    parser.add_argument("--dimensions", type=int,
+                        help="Shorten vectors to this many dimensions; set EMBEDDING_DIMENSIONS to match.")
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=4096)
+    parser.add_argument("--pq-m", type=int, default=64, help="PQ sub-quantizers; must divide the dimension.")
+    parser.add_argument("--nbits", type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    source = load_source_index(args.input)
+    vectors = source.reconstruct_n(0, source.ntotal)
+    LOGGER.info("Rebuilding %d vectors of dim %d as %s", source.ntotal, source.d, args.kind)
+
+    if args.dimensions:
+        vectors = shorten(vectors, args.dimensions)
+        LOGGER.info("Shortened vectors to %d dimensions", args.dimensions)
+
+    metric = source.metric_type
+    if args.metric == "ip":
+        # Unit-length vectors make inner product equal cosine similarity;
+        # rag_pipeline normalizes query vectors to match.
+        metric = faiss.METRIC_INNER_PRODUCT
+        faiss.normalize_L2(vectors)
+    elif args.metric == "l2":
+        metric = faiss.METRIC_L2
+
+    if args.kind == "flat":
+        index = build_flat(vectors, metric)
+    elif args.kind == "sq8":
+        index = build_sq8(vectors, metric)
+    elif args.kind == "hnsw":
+        index = build_hnsw(vectors, metric, m=args.hnsw_m, ef_construction=args.ef_construction)
+    else:
+        index = build_ivfpq(vectors, metric, nlist=args.nlist, pq_m=args.pq_m, nbits=args.nbits)
+
+    faiss.write_index(index, args.output)
+    LOGGER.info("Wrote %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import os
+import re
+import json
+import hashlib
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
+from typing import Any
+import orjson
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-from rag_pipeline import query_pipeline
+from rag_pipeline import query_pipeline, stream_query_pipeline, warm_up
 
 # ------------------------------
 # Logging
@@ -18,7 +24,24 @@ LOGGER = logging.getLogger("drug_rag_api")
 # ------------------------------
 # FastAPI App
 # ------------------------------
-app = FastAPI(title="Drug RAG API", version="1.0")
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (fastapi's own ORJSONResponse is deprecated)."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs in each worker after fork, so every worker primes its own connection pool.
+    await warm_up()
+    yield
+
+app = FastAPI(
+    title="Drug RAG API",
+    version="1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
 
 # ------------------------------
 # Directories
@@ -32,25 +55,63 @@ static_dir.mkdir(exist_ok=True)
 templates_dir.mkdir(exist_ok=True)
 
 # ------------------------------
-# Templates & Static Files
+# Index Page & Static Files
 # ------------------------------
-templates = Jinja2Templates(directory=str(templates_dir))
-app.mount("/static", StaticFiles(directory=str(static_dir)), name="static")
+# index.html has no template variables, so serve it as pre-read bytes with an ETag.
+index_path = templates_dir / "index.html"
+INDEX_HTML = index_path.read_bytes() if index_path.exists() else None
+INDEX_ETAG = f'"{hashlib.sha1(INDEX_HTML).hexdigest()}"' if INDEX_HTML is not None else None
+INDEX_CACHE_CONTROL = "public, max-age=300"
+
+# Assets with a content hash in the name (e.g. app.3f9a1c2b.js) never change.
+HASHED_ASSET_RE = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that marks content-hashed assets as immutable. Other assets
+    (e.g. script.js) must be revalidated, so a deploy is never paired with a
+    heuristically cached old copy; unchanged files still come back as 304s.
+    """
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code in (200, 304):
+            if HASHED_ASSET_RE.search(path):
+                response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+            else:
+                response.headers["Cache-Control"] = "no-cache"
+        return response
+
+app.mount("/static", CachedStaticFiles(directory=str(static_dir)), name="static")
 
 # ------------------------------
 # CORS
 # ------------------------------
 allowed = os.getenv("ALLOWED_ORIGINS", "")
-origins = [o.strip() for o in allowed.split(",") if o.strip()] if allowed else ["*"]
+origins = tuple(o.strip() for o in allowed.split(",") if o.strip())
+if not origins:
+    if os.getenv("RENDER"):
+        raise ValueError("ALLOWED_ORIGINS is not set. Add it to your Render environment.")
+    origins = ("*",)  # local development only
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Browsers reject credentialed requests against a wildcard origin.
+    allow_credentials="*" not in origins,
+    allow_methods=("GET", "POST"),
+    allow_headers=("Content-Type",),
+    max_age=86400,  # let browsers cache preflight responses for a day
 )
 
+# ------------------------------
+# Compression
+# ------------------------------
+# Answers and the landing page are text; gzip them when the client accepts it.
+# Needs starlette>=0.46, which leaves text/event-stream uncompressed; older
+# versions buffer the SSE deltas in the compressor until the stream ends.
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 # ------------------------------
 # Request / Response Models
 # ------------------------------
@@ -67,23 +128,54 @@ class QueryResponse(BaseModel):
 # Health Endpoints
 # ------------------------------
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"status": "ok"}
 
 @app.get("/readyz")
-def readyz():
+async def readyz():
     return {"ready": True}
 
 # ------------------------------
 # Query API Endpoint
 # ------------------------------
-@app.post("/query", response_model=QueryResponse)
-async def query_endpoint(request: QueryRequest):
+async def sse_events(request: QueryRequest):
+    # Each event carries a JSON-encoded text delta so newlines survive SSE framing.
+    # A failure mid-stream sends an `error` event instead of `[DONE]`.
+    try:
+        async for delta in stream_query_pipeline(
+            request.query,
+            top_k=request.top_k,
+            max_subqueries=request.max_subqueries
+        ):
+            yield f"data: {json.dumps(delta)}\n\n"
+    except Exception as exc:
+        LOGGER.exception("Streaming query failed: %s", exc)
+        yield f"event: error\ndata: {json.dumps('The answer was interrupted. Please try again.')}\n\n"
+        return
+    yield "data: [DONE]\n\n"
+
+@app.post(
+    "/query",
+    response_model=QueryResponse,
+    responses={200: {"content": {"text/event-stream": {}}}},
+)
+async def query_endpoint(request: QueryRequest, stream: bool = True):
+    """
+    Answer a query. Streams the final answer as server-sent events by default;
+    pass `?stream=0` for a single JSON response.
+    """
     if not request.query or not request.query.strip():
         raise HTTPException(status_code=400, detail="`query` must be a non-empty string.")
 
     LOGGER.info("Received query: %s", request.query[:200])
-    final_answer, _ = query_pipeline(
+    if stream:
+        return StreamingResponse(
+            sse_events(request),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
+
+    final_answer, _ = await query_pipeline(
         request.query,
         top_k=request.top_k,
         max_subqueries=request.max_subqueries
@@ -96,13 +188,14 @@ async def query_endpoint(request: QueryRequest):
 @app.get("/", response_class=HTMLResponse)
 async def render_ui(request: Request):
     """
-    Render the main index.html page for landing page on Render.
+    Serve the main index.html page for landing page on Render.
     """
-    template_path = templates_dir / "index.html"
-    if not template_path.exists():
+    if INDEX_HTML is None:
         raise HTTPException(status_code=500, detail="Template not found")
 
-    return templates.TemplateResponse(
-        "index.html",
-        {"request": request}  # only request is needed
-    )
+    headers = {"ETag": INDEX_ETAG, "Cache-Control": INDEX_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match", "")
+    if any(tag.strip() in (INDEX_ETAG, "W/" + INDEX_ETAG, "*") for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+
+    return Response(INDEX_HTML, media_type="text/html", headers=headers)
@@ -0,0 +1,41 @@
+# prepare_data.py
+"""
+Download the FAISS index and chunk metadata into the Hugging Face cache and
+write the Parquet metadata sidecar next to the CSV, so the app reads Parquet
+at startup instead of parsing the CSV.
+
+Run once at image build time (see Dockerfile):
+    python prepare_data.py
+"""
+import logging
+import os
+import pandas as pd
+from huggingface_hub import hf_hub_download
+
+LOGGER = logging.getLogger("prepare_data")
+
+HF_REPO = "PotatoUmair/drug-rag-data1"  # keep in sync with rag_pipeline.HF_REPO
+
+
+def download_file(filename: str) -> str:
+    return hf_hub_download(
+        repo_id=HF_REPO,
+        filename=filename,
+        repo_type="dataset"
+    )
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+
+    LOGGER.info("Downloaded index to %s", download_file("drug_embeddings.faiss"))
+
+    csv_path = download_file("drug_chunks_metadata.csv")
+    # Same path rag_pipeline.load_metadata looks for.
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    pd.read_csv(csv_path).to_parquet(parquet_path, index=False)
+    LOGGER.info("Wrote %s", parquet_path)
+
+
+if __name__ == "__main__":
+    main()
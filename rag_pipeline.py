@@ -1,31 +1,74 @@
 # rag_pipeline.py
 import os
+import asyncio
+import tempfile
+from collections import OrderedDict
 import logging
-from typing import List, Dict, Tuple
+from dataclasses import dataclass
+from typing import List, Dict, Tuple, Optional, AsyncIterator
 import numpy as np
 import pandas as pd
 import faiss
-from openai import OpenAI
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+import tiktoken
+import openai
+from openai import AsyncOpenAI
+from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
 from huggingface_hub import hf_hub_download
 from dotenv import load_dotenv
 
 # =====================
 # Load environment
 # =====================
-load_dotenv()  # local only; Render injects ENV vars automatically
+if not os.getenv("RENDER"):
+    load_dotenv()  # local only; Render injects ENV vars automatically
 
 LOGGER = logging.getLogger("rag_pipeline")
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY is not set. Add it to your .env or Render environment.")
+def _default_faiss_threads() -> int:
+    # Split the cores between gunicorn workers so OpenMP threads don't oversubscribe.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+@dataclass(frozen=True)
+class Settings:
+    """Pipeline configuration, read from the environment once at import."""
+    openai_api_key: str
+    embedding_model: str = "text-embedding-3-large"
+    embedding_dimensions: Optional[int] = None
+    decompose_model: str = "gpt-4o-mini"
+    answer_model: str = "gpt-4o-mini"
+    index_path: Optional[str] = None
+    embedding_cache_size: int = 10000
+    hnsw_ef_search: int = 64
+    ivf_nprobe: int = 16
+    faiss_threads: int = 1
+    max_context_tokens: int = 100000
+    subquery_dedup_threshold: float = 0.95
 
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-large")
-DECOMPOSE_MODEL = os.getenv("DECOMPOSE_MODEL", "gpt-4o-mini")
-ANSWER_MODEL = os.getenv("ANSWER_MODEL", "gpt-4o-mini")
+    @classmethod
+    def from_env(cls) -> "Settings":
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY is not set. Add it to your .env or Render environment.")
+        return cls(
+            openai_api_key=api_key,
+            embedding_model=os.getenv("EMBEDDING_MODEL", cls.embedding_model),
+            embedding_dimensions=int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None,
+            decompose_model=os.getenv("DECOMPOSE_MODEL", cls.decompose_model),
+            answer_model=os.getenv("ANSWER_MODEL", cls.answer_model),
+            index_path=os.getenv("INDEX_PATH") or None,
+            embedding_cache_size=int(os.getenv("EMBEDDING_CACHE_SIZE", cls.embedding_cache_size)),
+            hnsw_ef_search=int(os.getenv("HNSW_EF_SEARCH", cls.hnsw_ef_search)),
+            ivf_nprobe=int(os.getenv("IVF_NPROBE", cls.ivf_nprobe)),
+            faiss_threads=int(os.getenv("FAISS_THREADS", _default_faiss_threads())),
+            max_context_tokens=int(os.getenv("MAX_CONTEXT_TOKENS", cls.max_context_tokens)),
+            subquery_dedup_threshold=float(os.getenv("SUBQUERY_DEDUP_THRESHOLD", cls.subquery_dedup_threshold)),
+        )
+
+SETTINGS = Settings.from_env()
+
+# Tenacity (below) is the only retrier, so disable the SDK's built-in retries.
+client = AsyncOpenAI(api_key=SETTINGS.openai_api_key, timeout=20.0, max_retries=0)
 
 # =====================
 # Hugging Face files
@@ -41,7 +84,8 @@ def download_file(filename: str) -> str:
     )
     return path
 
-INDEX_FILE = download_file("drug_embeddings.faiss")
+# INDEX_PATH can point at a local index produced by build_index.py (HNSW / IVF-PQ).
+INDEX_FILE = SETTINGS.index_path or download_file("drug_embeddings.faiss")
 METADATA_FILE = download_file("drug_chunks_metadata.csv")
 # Optional: If you ever use embeddings.npy
 # EMBEDDINGS_FILE = download_file("embedding.npy")
@@ -49,129 +93,442 @@ METADATA_FILE = download_file("drug_chunks_metadata.csv")
 # =====================
 # Load FAISS + Metadata
 # =====================
+# Memory-map the index read-only: the OS page cache then holds a single copy
+# shared by every worker (run with gunicorn --preload), instead of one heap copy each.
+_INDEX_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+def read_index(path: str) -> faiss.Index:
+    """Read a FAISS index memory-mapped, also mapping flat codes where supported."""
+    mmap_ifc = getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+    if mmap_ifc:
+        try:
+            return faiss.read_index(path, _INDEX_IO_FLAGS | mmap_ifc)
+        except RuntimeError as exc:
+            # IVF indexes reject IO_FLAG_MMAP combined with IO_FLAG_MMAP_IFC.
+            LOGGER.info("Retrying index load without IO_FLAG_MMAP_IFC: %s", exc)
+    return faiss.read_index(path, _INDEX_IO_FLAGS)
+
 LOGGER.info("Loading FAISS index from %s", INDEX_FILE)
-_index = faiss.read_index(INDEX_FILE)
+_index = read_index(INDEX_FILE)
 
-LOGGER.info("Loading metadata from %s", METADATA_FILE)
-_metadata = pd.read_csv(METADATA_FILE)
+# Search-time knobs for approximate indexes; ignored for flat indexes.
+if hasattr(_index, "hnsw"):
+    _index.hnsw.efSearch = SETTINGS.hnsw_ef_search
+_ivf = faiss.try_extract_index_ivf(_index)
+if _ivf is not None:
+    _ivf.nprobe = SETTINGS.ivf_nprobe
+
+faiss.omp_set_num_threads(SETTINGS.faiss_threads)
+
+# Inner-product indexes are built from L2-normalized vectors (cosine similarity),
+# so queries must be normalized too. Scores are then "higher is better".
+_normalize_queries = _index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+if SETTINGS.embedding_dimensions and SETTINGS.embedding_dimensions != _index.d:
+    raise ValueError(
+        f"EMBEDDING_DIMENSIONS={SETTINGS.embedding_dimensions} does not match the index dimension {_index.d}."
+    )
+
+# text-embedding-3 models can return any length up to their native size, so default
+# to the index dimension; this also covers indexes shortened by build_index.py.
+_query_dimensions = SETTINGS.embedding_dimensions or (
+    _index.d if SETTINGS.embedding_model.startswith("text-embedding-3") else None
+)
+
+def load_metadata(csv_path: str) -> pd.DataFrame:
+    """
+    Load chunk metadata from its Parquet sidecar, which the Docker image builds
+    with prepare_data.py. Elsewhere the CSV is converted on first use.
+    """
+    parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+    if os.path.exists(parquet_path):
+        LOGGER.info("Loading metadata from %s", parquet_path)
+        try:
+            return pd.read_parquet(parquet_path)
+        except Exception as exc:
+            LOGGER.warning("Unreadable Parquet metadata at %s; falling back to CSV. Error: %s", parquet_path, exc)
+
+    LOGGER.info("Loading metadata from %s", csv_path)
+    metadata = pd.read_csv(csv_path, memory_map=True)
+    tmp_path = None
+    try:
+        # Write to a temp file and rename, so a crash or a concurrent worker
+        # never sees a half-written sidecar.
+        fd, tmp_path = tempfile.mkstemp(suffix=".parquet.tmp", dir=os.path.dirname(parquet_path))
+        os.close(fd)
+        metadata.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+    except Exception as exc:
+        LOGGER.warning("Could not cache metadata as Parquet at %s: %s", parquet_path, exc)
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return metadata
+
+_metadata = load_metadata(METADATA_FILE)
+
+# Column arrays for the retrieval hot path; avoids building a Series per hit.
+_n_chunks = len(_metadata)
+_drug_name = _metadata["drug_name"].to_numpy()
+_drugbank_id = _metadata["drugbank_id"].to_numpy()
+if "chunk_index" in _metadata:
+    # Nullable Int64 so a missing value becomes None instead of failing at import.
+    _chunk_index = _metadata["chunk_index"].astype("Int64").to_numpy(dtype=object, na_value=None)
+else:
+    _chunk_index = np.full(_n_chunks, None, dtype=object)
+_chunk_text = _metadata["chunk_text"].to_numpy()
+_cols = (_drug_name, _drugbank_id, _chunk_index, _chunk_text)
 
 # =====================
 # Retry Decorator
 # =====================
+# Only transient failures are retried; auth and bad-request errors fail fast.
+RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
 retry_decorator = retry(
     reraise=True,
-    wait=wait_exponential(multiplier=1, min=1, max=20),
-    stop=stop_after_attempt(5),
-    retry=retry_if_exception_type(Exception)
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS)
 )
 
 # =====================
 # Embedding Function
 # =====================
+# LRU cache of query embeddings keyed by (model, normalized text), so repeated
+# sub-queries skip the embedding round-trip entirely.
+_embedding_cache: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+
+def _normalize_query_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+def _embedding_kwargs() -> Dict:
+    return {"dimensions": _query_dimensions} if _query_dimensions else {}
+
 @retry_decorator
-def _create_embedding(text: str) -> np.ndarray:
-    resp = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
-    emb = np.array(resp.data[0].embedding, dtype="float32")
-    return emb
+async def _request_embeddings(texts: List[str]) -> np.ndarray:
+    # The embeddings endpoint accepts a list, so N texts cost one round-trip.
+    resp = await client.embeddings.create(model=SETTINGS.embedding_model, input=texts, **_embedding_kwargs())
+    return np.asarray([d.embedding for d in resp.data], dtype="float32")
+
+async def _embed_batch(texts: List[str]) -> np.ndarray:
+    """Embed texts as a (len(texts), d) matrix, requesting only cache misses."""
+    keys = [(SETTINGS.embedding_model, _normalize_query_text(t)) for t in texts]
+    # Take cache hits before awaiting: a concurrent request may evict them meanwhile.
+    hits: Dict[Tuple[str, str], np.ndarray] = {}
+    missing: Dict[Tuple[str, str], str] = {}
+    for key, text in zip(keys, texts):
+        if key in hits or key in missing:
+            continue
+        cached = _embedding_cache.get(key)
+        if cached is not None:
+            _embedding_cache.move_to_end(key)
+            hits[key] = cached
+        else:
+            missing[key] = text
+
+    fetched: Dict[Tuple[str, str], np.ndarray] = {}
+    if missing:
+        embs = await _request_embeddings(list(missing.values()))
+        fetched = dict(zip(missing.keys(), embs))
+
+    rows = [hits[key] if key in hits else fetched[key] for key in keys]
+
+    if SETTINGS.embedding_cache_size > 0:
+        for key, emb in fetched.items():
+            _embedding_cache[key] = emb.copy()
+        while len(_embedding_cache) > SETTINGS.embedding_cache_size:
+            _embedding_cache.popitem(last=False)
+    return np.vstack(rows).astype("float32")
+
+async def _create_embedding(text: str) -> np.ndarray:
+    embs = await _embed_batch([text])
+    return embs[0]
 
 # =====================
 # Chat Completion Wrapper
 # =====================
 @retry_decorator
-def _llm_chat_completion(prompt: str, model: str, temperature: float = 0.0) -> str:
-    resp = client.chat.completions.create(
+async def _llm_chat_completion(prompt: str, model: str, temperature: float = 0.0) -> str:
+    resp = await client.chat.completions.create(
         model=model,
         messages=[{"role": "user", "content": prompt}],
         temperature=temperature
     )
     return resp.choices[0].message.content.strip()
 
+@retry_decorator
+async def _open_chat_stream(prompt: str, model: str, temperature: float = 0.0):
+    # Only opening the stream is retried; a stream that fails midway is not replayed.
+    return await client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        stream=True
+    )
+
+async def _llm_chat_completion_stream(prompt: str, model: str, temperature: float = 0.0) -> AsyncIterator[str]:
+    stream = await _open_chat_stream(prompt, model=model, temperature=temperature)
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        # Release the HTTP connection even if the client disconnects mid-stream.
+        await stream.close()
+
 # =====================
-# Pipeline Steps
+# Prompt Templates
 # =====================
-def decompose_query(user_query: str, max_subqueries: int = 5) -> List[str]:
-    prompt = f"""
-You are an expert in drug information. Split the following user query into up to {max_subqueries} independent sub-questions.
+DECOMPOSE_TMPL = """
+You are an expert in drug information. Split the following user query into up to {n} independent sub-questions.
 Return each sub-question on a separate line.
 
-User query: "{user_query}"
+User query: "{q}"
+"""
+
+ANSWER_TMPL = """
+You are a medical expert. Answer the question below using ONLY the information from the retrieved chunks.
+Do not make assumptions or hallucinate. Be concise and precise.
+
+{chunks}
+
+Question: {q}
+Answer:
+"""
+
+COMBINE_TMPL = """
+You are a medical expert. The user asked the following question:
+
+{q}
+
+Here are the answers to sub-questions:
+
+{answers}
+
+Combine these into a single, concise, coherent answer. Only use the provided information.
+Final Answer:
 """
+
+def _load_encoder(model: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as exc:
+        LOGGER.warning("Tokenizer unavailable for %s; prompts will not be truncated. Error: %s", model, exc)
+        return None
+
+_encoder = _load_encoder(SETTINGS.answer_model)
+
+def _build_answer_prompt(sub_query: str, chunks: List[Dict]) -> str:
+    """Fill ANSWER_TMPL, truncating chunks so the prompt fits max_context_tokens."""
+    chunk_texts = [f"Chunk: {c['text']}" for c in chunks]
+    prompt = ANSWER_TMPL.format(chunks="\n\n".join(chunk_texts), q=sub_query)
+    # A token is at least one UTF-8 byte, so a prompt within budget in bytes
+    # needs no tokenizing at all (the common case with top_k chunks).
+    if _encoder is None or len(prompt.encode("utf-8")) <= SETTINGS.max_context_tokens:
+        return prompt
+
+    budget = SETTINGS.max_context_tokens - len(_encoder.encode(ANSWER_TMPL.format(chunks="", q=sub_query)))
+    parts = []
+    for text in chunk_texts:
+        tokens = _encoder.encode(text)
+        if len(tokens) > budget:
+            if budget > 0:
+                parts.append(_encoder.decode(tokens[:budget]))
+            break
+        parts.append(text)
+        budget -= len(tokens)
+    return ANSWER_TMPL.format(chunks="\n\n".join(parts), q=sub_query)
+
+# =====================
+# Pipeline Steps
+# =====================
+async def warm_up() -> None:
+    """
+    Open the OpenAI connection at startup so the first query skips the TLS handshake,
+    and check that query embeddings match the index dimension. Transient errors are
+    logged and ignored; anything else (e.g. a 400 for an unsupported `dimensions`)
+    is a misconfiguration and aborts startup.
+    """
     try:
-        text = _llm_chat_completion(prompt, model=DECOMPOSE_MODEL, temperature=0.0)
+        resp = await client.embeddings.create(
+            model=SETTINGS.embedding_model, input="warmup", **_embedding_kwargs()
+        )
+    except RETRYABLE_ERRORS as exc:
+        LOGGER.warning("Warm-up request failed; continuing without it. Error: %s", exc)
+        return
+
+    dim = len(resp.data[0].embedding)
+    if dim != _index.d:
+        raise ValueError(
+            f"{SETTINGS.embedding_model} returns {dim}-d embeddings but the index is {_index.d}-d. "
+            "Set EMBEDDING_MODEL / EMBEDDING_DIMENSIONS to match the index."
+        )
+
+async def decompose_query(user_query: str, max_subqueries: int = 5) -> List[str]:
+    prompt = DECOMPOSE_TMPL.format(n=max_subqueries, q=user_query)
+    try:
+        text = await _llm_chat_completion(prompt, model=SETTINGS.decompose_model, temperature=0.0)
         sub_queries = [q.strip() for q in text.splitlines() if q.strip()]
         return sub_queries or [user_query]
     except Exception as exc:
         LOGGER.exception("Decomposition failed; using original query. Error: %s", exc)
         return [user_query]
 
-def retrieve_chunks(query_text: str, top_k: int = 3) -> List[Dict]:
+def _search_chunks(embs: np.ndarray, top_k: int) -> List[List[Dict]]:
+    """Search the index once for every row of `embs` and return chunks per row."""
+    if _normalize_queries:
+        faiss.normalize_L2(embs)
+    distances, indices = _index.search(embs, top_k)
+    all_results = []
+    for row_indices, row_distances in zip(indices, distances):
+        mask = (row_indices >= 0) & (row_indices < _n_chunks)
+        valid_idx = row_indices[mask]
+        # One gather per column, then plain Python values: no per-field NumPy scalars.
+        names, dbids, chunk_idxs, texts = (col[valid_idx].tolist() for col in _cols)
+        all_results.append([
+            {
+                "row_id": row_id,
+                "drug_name": name,
+                "drugbank_id": dbid,
+                "chunk_index": chunk_idx,
+                "text": text,
+                "distance": dist
+            }
+            for row_id, name, dbid, chunk_idx, text, dist in zip(
+                valid_idx.tolist(), names, dbids, chunk_idxs, texts, row_distances[mask].tolist()
+            )
+        ])
+    return all_results
+
+async def retrieve_chunks(query_text: str, top_k: int = 3) -> List[Dict]:
     try:
-        emb = _create_embedding(query_text)
+        emb = await _create_embedding(query_text)
     except Exception as exc:
         LOGGER.exception("Embedding creation failed: %s", exc)
         return []
 
-    emb = emb.reshape(1, -1).astype("float32")
-    distances, indices = _index.search(emb, top_k)
-    results = []
-    for idx, dist in zip(indices[0], distances[0]):
-        if idx < 0 or idx >= len(_metadata):
-            continue
-        row = _metadata.iloc[int(idx)]
-        results.append({
-            "drug_name": row.get("drug_name"),
-            "drugbank_id": row.get("drugbank_id"),
-            "chunk_index": int(row.get("chunk_index")) if "chunk_index" in row else None,
-            "text": row.get("chunk_text"),
-            "distance": float(dist)
-        })
-    return results
-
-def generate_answer(sub_query: str, chunks: List[Dict]) -> str:
+    results = await asyncio.to_thread(_search_chunks, emb.reshape(1, -1), top_k)
+    return results[0]
+
+async def generate_answer(sub_query: str, chunks: List[Dict]) -> str:
     if not chunks:
         return "No relevant information found."
-    prompt_chunks = "\n\n".join([f"Chunk: {c['text']}" for c in chunks])
-    prompt = f"""
-You are a medical expert. Answer the question below using ONLY the information from the retrieved chunks.
-Do not make assumptions or hallucinate. Be concise and precise.
-
-{prompt_chunks}
-
-Question: {sub_query}
-Answer:
-"""
+    prompt = _build_answer_prompt(sub_query, chunks)
     try:
-        return _llm_chat_completion(prompt, model=ANSWER_MODEL, temperature=0.0)
+        return await _llm_chat_completion(prompt, model=SETTINGS.answer_model, temperature=0.0)
     except Exception as exc:
         LOGGER.exception("Answer generation failed for '%s': %s", sub_query, exc)
         return "Error generating answer."
 
-def combine_answers(user_query: str, sub_query_answers: List[Dict]) -> str:
+def _build_combine_prompt(user_query: str, sub_query_answers: List[Dict]) -> str:
     combined_text = "\n".join([f"{i+1}. {a['answer']}" for i, a in enumerate(sub_query_answers)])
-    prompt = f"""
-You are a medical expert. The user asked the following question:
+    return COMBINE_TMPL.format(q=user_query, answers=combined_text)
 
-{user_query}
+async def combine_answers(user_query: str, sub_query_answers: List[Dict]) -> str:
+    prompt = _build_combine_prompt(user_query, sub_query_answers)
+    try:
+        return await _llm_chat_completion(prompt, model=SETTINGS.answer_model, temperature=0.0)
+    except Exception as exc:
+        LOGGER.exception("Final answer combination failed: %s", exc)
+        return "Error generating final answer."
 
-Here are the answers to sub-questions:
+async def combine_answers_stream(user_query: str, sub_query_answers: List[Dict]) -> AsyncIterator[str]:
+    """
+    Yield the final answer as it is generated. A failure before any text falls back
+    to the same message as combine_answers; a failure mid-answer is re-raised so the
+    caller can tell the client the answer was cut off.
+    """
+    prompt = _build_combine_prompt(user_query, sub_query_answers)
+    sent_any = False
+    try:
+        async for delta in _llm_chat_completion_stream(prompt, model=SETTINGS.answer_model, temperature=0.0):
+            sent_any = True
+            yield delta
+    except Exception as exc:
+        if sent_any:
+            raise
+        LOGGER.exception("Final answer combination failed: %s", exc)
+        yield "Error generating final answer."
 
-{combined_text}
+def _group_similar(embs: np.ndarray, threshold: float) -> List[List[int]]:
+    """Union-find rows whose cosine similarity is >= threshold; groups are in row order."""
+    unit = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+    sims = unit @ unit.T
+    parent = list(range(len(embs)))
 
-Combine these into a single, concise, coherent answer. Only use the provided information.
-Final Answer:
-"""
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(sims, k=1) >= threshold)):
+        parent[find(int(j))] = find(int(i))
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(embs)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+def _merge_chunks(chunk_lists: List[List[Dict]]) -> List[Dict]:
+    # Key on the FAISS row id: chunk_index may be missing (None) in the metadata.
+    seen = set()
+    merged = []
+    for chunks in chunk_lists:
+        for c in chunks:
+            if c["row_id"] not in seen:
+                seen.add(c["row_id"])
+                merged.append(c)
+    return merged
+
+async def answer_sub_queries(user_query: str, top_k: int = 3, max_subqueries: int = 5) -> List[Dict]:
+    sub_queries = await decompose_query(user_query, max_subqueries=max_subqueries)
+
+    # One embeddings request and one FAISS pass for all sub-queries.
     try:
-        return _llm_chat_completion(prompt, model=ANSWER_MODEL, temperature=0.0)
+        embs = await _embed_batch(sub_queries)
     except Exception as exc:
-        LOGGER.exception("Final answer combination failed: %s", exc)
-        return "Error generating final answer."
+        LOGGER.exception("Embedding creation failed: %s", exc)
+        embs = None
+
+    if embs is None:
+        groups = [[i] for i in range(len(sub_queries))]
+        chunks_per_query = [[] for _ in sub_queries]
+    else:
+        # Near-duplicate sub-queries would retrieve the same chunks and cost an extra
+        # LLM call each; answer each group once, using the first sub-query as its text.
+        groups = _group_similar(embs, SETTINGS.subquery_dedup_threshold)
+        # FAISS releases the GIL, so searching in a worker thread keeps the loop free.
+        chunks_per_query = await asyncio.to_thread(_search_chunks, embs, top_k)
 
-def query_pipeline(user_query: str, top_k: int = 3, max_subqueries: int = 5) -> Tuple[str, List[Dict]]:
-    sub_queries = decompose_query(user_query, max_subqueries=max_subqueries)
-    answers = []
-    for sq in sub_queries:
-        chunks = retrieve_chunks(sq, top_k=top_k)
-        answer = generate_answer(sq, chunks)
-        answers.append({"sub_query": sq, "answer": answer, "chunks": chunks})
-    final_answer = combine_answers(user_query, answers)
+    representatives = [sub_queries[g[0]] for g in groups]
+    group_chunks = [_merge_chunks([chunks_per_query[i] for i in g]) for g in groups]
+
+    # Answers are independent OpenAI round-trips, so run them concurrently.
+    answer_texts = await asyncio.gather(*[
+        generate_answer(sq, chunks) for sq, chunks in zip(representatives, group_chunks)
+    ])
+    answers = [
+        {"sub_query": sq, "answer": answer, "chunks": chunks}
+        for sq, answer, chunks in zip(representatives, answer_texts, group_chunks)
+    ]
+    return answers
+
+async def query_pipeline(user_query: str, top_k: int = 3, max_subqueries: int = 5) -> Tuple[str, List[Dict]]:
+    answers = await answer_sub_queries(user_query, top_k=top_k, max_subqueries=max_subqueries)
+    final_answer = await combine_answers(user_query, answers)
     return final_answer, answers
+
+async def stream_query_pipeline(user_query: str, top_k: int = 3, max_subqueries: int = 5) -> AsyncIterator[str]:
+    """Like query_pipeline, but yields the final answer as it is generated."""
+    answers = await answer_sub_queries(user_query, top_k=top_k, max_subqueries=max_subqueries)
+    async for delta in combine_answers_stream(user_query, answers):
+        yield delta
@@ -137,25 +137,35 @@ class ChatUI {
 
     const typingId = this.showTypingIndicator();
 
+    let botMessage = null;
     try {
-      const response = await this.sendToBackend(message);
+      await this.sendToBackend(message, (delta) => {
+        if (!botMessage) {
+          this.removeTypingIndicator(typingId);
+          botMessage = this.addMessage("bot", "");
+        }
+        botMessage.textContent += delta;
+        this.scrollToBottom();
+      });
 
-      this.removeTypingIndicator(typingId);
-      this.addMessage(
-        "bot",
-        response?.final_answer || "I couldn't process your request. Please try again."
-      );
+      if (!botMessage) {
+        this.removeTypingIndicator(typingId);
+        this.addMessage("bot", "I couldn't process your request. Please try again.");
+      }
     } catch (error) {
       console.error("Error:", error);
       this.removeTypingIndicator(typingId);
       this.addMessage(
         "bot",
-        "Sorry, I encountered an error. Please try again later."
+        botMessage
+          ? "Sorry, the answer above was interrupted. Please try again."
+          : "Sorry, I encountered an error. Please try again later."
       );
     }
   }
 
-  async sendToBackend(message) {
+  // Streams the answer as server-sent events, calling onDelta for each text piece.
+  async sendToBackend(message, onDelta) {
     const response = await fetch("/query", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
@@ -165,7 +175,33 @@ class ChatUI {
     if (!response.ok) {
       throw new Error(`HTTP error! Status: ${response.status}`);
     }
-    return await response.json();
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+
+      const events = buffer.split("\n\n");
+      buffer = events.pop();
+      for (const event of events) {
+        let type = "message";
+        let data = "";
+        for (const line of event.split("\n")) {
+          if (line.startsWith("event: ")) type = line.slice(7);
+          else if (line.startsWith("data: ")) data = line.slice(6);
+        }
+        if (type === "error") throw new Error(JSON.parse(data));
+        if (data === "[DONE]") return;
+        if (data) onDelta(JSON.parse(data));
+      }
+    }
+
+    // No [DONE]: the connection closed before the answer finished.
+    throw new Error("Stream ended unexpectedly");
   }
 
   addMessage(sender, text) {
@@ -174,6 +210,7 @@ class ChatUI {
     messageDiv.textContent = text;
     this.chatMessages.appendChild(messageDiv);
     this.scrollToBottom();
+    return messageDiv;
   }
 
   showTypingIndicator() {